@@ -20,25 +20,102 @@ import os
 import re
 from   bs4         import BeautifulSoup
 from   typing      import List, Tuple, Dict
-from   statistics  import mode
 from   collections import Counter
+from   functools   import lru_cache
+
+# lxml is much faster than Python's html.parser, but is optional
+try:
+    import lxml
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html.parser"
 
 
 # Set of block tags in Evernote / HTML (and maybe one or two extras that help with the logic of the code)
-block_level_elements = {
+block_level_elements = frozenset({
     'address', 'article', 'aside', 'blockquote', 'canvas', 
     'dd', 'details', 'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure', 
     'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 
     'main', 'nav', 'ol', 'p', 'pre', 'section', 'table',
     'tfoot', 'ul', 'video',
     # 'br', 'code', 'en-todo', 'form', 
-}
+})
+
+# Precompiled regular expressions
+_RE_URL               = re.compile(r'\b(?:http|https|ftp)://\S+') # URLs
+_RE_EN_SYNTAX         = re.compile(r"--en-syntaxLanguage:(.+?);")
+_RE_EN_ID             = re.compile(r"--en-id:([0-9a-f-]+);")
+_RE_PADDING_LEFT      = re.compile(r"(?:padding|margin)-left\s*:\s*(\d+)\s*px")
+_RE_EN_HIGHLIGHT      = re.compile(r'--en-highlight:(\w+)')
+_RE_EVERNOTE_INTERNAL = re.compile(r"^(evernote:///|https://www.evernote.com/|https://share.evernote.com/note/).+")
+_RE_MD_LINK           = re.compile(r'^\[(.*?)\]\((.*?)\)(.*)$', flags=re.S)
+_RE_SPAN_STYLE        = re.compile(r'<span style="(.*?)">(.*?)</span>')
+_RE_GUID_EVERNOTE_URI = re.compile(r"evernote:///view/[^/]+/[^/]+/([0-9a-f-]+)/")
+_RE_GUID_EVERNOTE_WEB = re.compile(r"https://www.evernote.com/[^/]+/[^/]+/[^/]+/[^/]+/([0-9a-f-]+)")
+_RE_GUID_SHARE        = re.compile(r"https://share.evernote.com/note/(.+)")
+_RE_SCRIPT_STYLE      = re.compile(r"<(?:script|style)\b", re.I)
+# Used by escape_non_url(): all Markdown escapes in a single pass (see comments there)
+_RE_ESCAPE = re.compile(
+    r"(?P<special>[\[\]`*$])"
+    r"|(?P<underscore>(?:^|\s)_+(?=\S))"
+    r"|(?P<percent>%%)"
+    r"|(?P<html_tag><(?=[^>]+>))"
+    r"|(?P<hash>(?:^|\s)#(?=\S)(?!#))"
+    r"|(?P<caret>(?:^|\s)\^(?=\S))"
+    r"|(?P<equal_tilde>[=~]{2,}(?=\S))"
+    r"|(?P<line_start>(?m:^)\s*(?![=~]{2,}\S)[\-+=>#|])"
+    r"|(?P<ordered_list>(?m:^)\s*\d+(?=\.\s))"
+)
+# Characters (or sequences) without which _RE_ESCAPE can't match, for a quick check before it
+_RE_ESCAPE_TRIGGER = re.compile(r"[\[\]`*$_%<#^=~\-+>|]|\d\.")
+
+@lru_cache(maxsize=1024)
+def _escape_sequence(text, kind) -> str:
+    """Return the escaped `text` matched by _RE_ESCAPE, in its group named `kind`."""
+    # The same few short sequences (" #", "[", "==", ...) match over and over,
+    # and the escaped text depends only on the matched text, so remember it.
+    if kind == "ordered_list":
+        escaped = f"{text}\\"
+    elif kind == "underscore" or kind == "equal_tilde":
+        # Escape each character of the sequence, e.g. "==" => "\=\="
+        chars   = text.lstrip()
+        escaped = text[:len(text) - len(chars)] + "\\" + "\\".join(chars)
+    else:
+        # Escape only the last character, e.g. " #" => " \#"
+        escaped = f"{text[:-1]}\\{text[-1]}"
+    return escaped
 
 class EvernoteHTMLToMarkdownConverter:
     def __init__(self, use_html=True):
         self.soup            = None     # BeautifulSoup object
         self.use_html        = use_html # if True, use some HTML for things not supported by Obsidian Markdown
-        self.url_pattern     = re.compile(r'\b(?:http|https|ftp)://\S+') # Regex pattern for URLs
+        self.url_pattern     = _RE_URL  # Regex pattern for URLs
+
+        # Handlers for different HTML elements
+        self._dispatch = {
+            'div'       : self._process_div,
+            'p'         : self._process_text_element,
+            'span'      : self._process_text_element,
+            'font'      : self._process_text_element,
+            'h1'        : self._process_header,
+            'h2'        : self._process_header,
+            'h3'        : self._process_header,
+            'h4'        : self._process_header,
+            'h5'        : self._process_header,
+            'h6'        : self._process_header,
+            'ul'        : self._process_list,
+            'ol'        : self._process_list,
+            'li'        : self._process_list_item,
+            'table'     : self._process_table,
+            'a'         : self._process_link,
+            'img'       : self._process_image,
+            'br'        : lambda node: '\n',
+            'hr'        : lambda node: '___\n', # or '---', '* * *'
+            'en-todo'   : self._process_checkbox,
+            'en-media'  : self._process_media,
+        }
+        for tag in ('b', 'strong', 'i', 'em', 'u', 's', 'del', 'sup', 'sub', 'blockquote', 'code'):
+            self._dispatch[tag] = self._process_simple_tags
 
 
     def convert_html_to_markdown(
@@ -54,23 +131,34 @@ class EvernoteHTMLToMarkdownConverter:
 
         self.tasks        = tasks        # dict. for tasks (provided by caller)
         self.guid_to_path = guid_to_path # dict. for links (provided by caller)
-        self.hash_to_path = hash_to_path # dict. for attachments (provided by caller)
+        self.hash_to_path = hash_to_path # dict. for attachments (provided by caller), K: MD5 hash as bytes
+        if hash_to_path and isinstance(next(iter(hash_to_path)), int):
+            # Older callers used int(hash, 16) as keys
+            self.hash_to_path = {(k.to_bytes(16, "big") if isinstance(k, int) else k): v for k, v in hash_to_path.items()}
         self.options      = options      # dict. for options
 
+        # Options used while processing nodes (constant for the whole document)
+        self._escape_brackets   = options.get("escape_brackets",   False)
+        self._remove_green_link = options.get("remove_green_link", True)
+        self._pdf_view          = options.get("pdf_view",          "default")
+
         # Reset some variables
         self.list_stack    = []
         self.indent_level  = 0        # used in lists, list items
         self.number_indent = {}       # used in ordered lists
-        self.warnings      = []       # list of warnings returned after conversion
+        self.warnings      = {}       # {warning: count} of warnings returned after conversion
         self.inside_pre    = False    # True if processing content that should not be escaped
         self.inside_table  = False    # True if processing a table
+        self.escape_cache  = {}       # {(text, inside_table): escaped text}, since notes repeat a lot of text
 
         # Parse HTML
-        self.soup = BeautifulSoup(html_content, 'html.parser')
+        self.soup = BeautifulSoup(html_content, html_parser)
 
         # Remove script and style elements
-        for element in self.soup(['script', 'style']):
-            element.decompose()
+        # (not allowed in Evernote notes, so skip searching the whole tree if there are none)
+        if _RE_SCRIPT_STYLE.search(html_content):
+            for element in self.soup(['script', 'style']):
+                element.decompose()
 
         # Convert to markdown
         markdown = self._process_node(self.soup)
@@ -81,9 +169,8 @@ class EvernoteHTMLToMarkdownConverter:
             markdown = '\n'.join(properties) + markdown
 
         # Return a short(er) list of warnings
-        counter = Counter(self.warnings)
         sorted_warnings = sorted(
-            counter.items(),
+            self.warnings.items(),
             key=lambda x: (-x[1], x[0]) # First by count (descending), then by name (ascending)
         )
         warnings = [
@@ -101,83 +188,55 @@ class EvernoteHTMLToMarkdownConverter:
         """
         if node.name is None:
             # Ignore stray "\n" outside tags (appears only in old notes?)
-            if node.text == "\n":
+            if node == "\n":
                 return ""
             return self._escape_text(node)
 
-        def save_result(text):
-            if text:
-                result.append(text)
-
-        result = []
-
         # Handle different HTML elements
-        if node.name == 'div':
-            save_result(self._process_div(node))
-        elif node.name in ['p', 'span', 'font']:
-            save_result(self._process_text_element(node))
-        elif node.name in ['b', 'strong', 'i', 'em', 'u', 's', 'del', 'sup', 'sub', 'blockquote', 'code']:
-            save_result(self._process_simple_tags(node))
-        elif node.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-            save_result(self._process_header(node))
-        elif node.name in ['ul', 'ol']:
-            save_result(self._process_list(node))
-        elif node.name == 'li':
-            save_result(self._process_list_item(node))
-        elif node.name == 'table':
-            save_result(self._process_table(node))
-        elif node.name == 'a':
-            save_result(self._process_link(node))
-        elif node.name == 'img':
-            save_result(self._process_image(node))
-        elif node.name == 'br':
-            save_result('\n')
-        elif node.name == 'hr':
-            save_result('___\n') # or '---', '* * *'
-        elif node.name == 'en-todo':
-            save_result(self._process_checkbox(node))
-        elif node.name == 'en-media':
-            save_result(self._process_media(node))
-        else:
-            # Process other elements recursively
-            for child in node.children:
-                save_result(self._process_node(child))
+        if (handler := self._dispatch.get(node.name)):
+            return handler(node)
 
-        return ''.join(result)
+        # Process other elements recursively
+        return ''.join([self._process_node(child) for child in node.contents])
 
-    def _newline_prefix(self, node) -> str:
+    def _newline_prefix(self, node, _block=block_level_elements) -> str:
         """Add a newline before the text if the node is a block-level element after a non-block-level element."""
-        if (node.name in block_level_elements 
-            and node.previous_sibling
-            and node.previous_sibling.name
-            and node.previous_sibling.name not in block_level_elements
+        # (_block is bound at definition time to avoid a global lookup on each call)
+        if (node.name in _block
+            and (previous := node.previous_sibling)
+            and previous.name
+            and previous.name not in _block
         ):
             return "\n"
         return ""
 
+    def _warn(self, warning: str):
+        """Add a warning (or count it again, if repeated)."""
+        self.warnings[warning] = self.warnings.get(warning, 0) + 1
+
     def _use_html(self, html: str) -> bool:
         """Helper function that checks if HTML should be used or not (and warns in each case)."""
-        self.warnings.append(f"{'Added' if self.use_html else 'Removed'} unsupported HTML: {html}")
+        self._warn(f"{'Added' if self.use_html else 'Removed'} unsupported HTML: {html}")
         return self.use_html
 
     def _process_div(self, node) -> str:
         """Process div elements, handling special cases like alignment."""
         style   = node.get('style', '')
-        result  = self._process_node_children(node)
+        result  = self._process_node_children(node, style)
 
         # Table of contents
         if "--en-tableofcontents:true" in style:
             # Shouldn't be too hard to implement, but might just not be worth it
             # since Obsidian can show a note outline in the right side bar.
-            self.warnings.append("Ignored Table of Contents (conversion not implemented)")
+            self._warn("Ignored Table of Contents (conversion not implemented)")
             result = '==Evernote Table of Contents removed during conversion! In Obsidian, use "Open linked view" > "Open outline" instead.=='
         # Code block
         elif "--en-codeblock:true" in style:
-            language = (re.findall("--en-syntaxLanguage:(.+?);", style) or [""])[0]
+            language = match[1] if (match := _RE_EN_SYNTAX.search(style)) else ""
             result = f"```{language}\n{result}```"
         # Tasks
         elif "--en-task-group:true" in style:
-            id = re.findall("--en-id:([0-9a-f-]+);", style)[0]
+            id = match[1] if (match := _RE_EN_ID.search(style)) else ""
             if self.tasks and id in self.tasks:
                   result = self.tasks[id]
             else: result = f"- [ ] ==Could not find task(s) ID {id} during conversion=="
@@ -205,9 +264,8 @@ class EvernoteHTMLToMarkdownConverter:
             # Note 1: newer versions of Evernote use padding, older versions use margin.
             # Note 2: indented lines following a blank line are interpreted as code blocks.
             #         Workaround: use a bullet list (works even if you set it on just the 1s line!).
-            padding_left = re.findall(r"(?:padding|margin)-left\s*:\s*(\d+)\s*px", style)
-            if padding_left:
-                indent = "    " * (int(padding_left[0])//40)
+            if (padding_left := _RE_PADDING_LEFT.search(style)):
+                indent = "    " * (int(padding_left[1])//40)
                 result = f'{indent}{result}'
                 # If list item has \n in the content, add indent
                 result = result.replace("\n", f"\n{indent}")
@@ -222,7 +280,8 @@ class EvernoteHTMLToMarkdownConverter:
 
     def _process_text_element(self, node) -> str:
         """Process text-related elements with styling."""
-        content = self._process_node_children(node)
+        style   = node.get('style') or ''
+        content = self._process_node_children(node, style)
 
         # <font color="#FF0000">...</font>
         # <font> is deprecated, but still found in old notes.
@@ -230,9 +289,7 @@ class EvernoteHTMLToMarkdownConverter:
             if self._use_html("font color"):
                 return f'<span style="color:{color}">{content}</span>'
 
-        if node.get('style'):
-            style = node.get('style')
-
+        if style:
             for tag_name, test in ( 
                 ("b", "font-weight: bold;"), 
                 ("s", "line-through"), 
@@ -243,7 +300,7 @@ class EvernoteHTMLToMarkdownConverter:
                         content = self._process_simple_tags(new_tag)
 
             if '--en-highlight:' in style:
-                color = re.search(r'--en-highlight:(\w+)', style)
+                color = _RE_EN_HIGHLIGHT.search(style)
                 if color:
                     if self._use_html("highlight / background-color") and color.group(1) != "yellow":
                         content = f'<span style="color: white; background-color: {color.group(1)}">{content}</span>'
@@ -255,14 +312,13 @@ class EvernoteHTMLToMarkdownConverter:
                     # For some time, Evernote added a green color to internal links.
                     # We can keep the link as green if the user wants to use HTML
                     # AND didn't ask to remove green links.
-                    internal_link = node.parent and node.parent.name == 'a' and re.match(
-                        "^(evernote:///|https://www.evernote.com/|https://share.evernote.com/note/).+",
+                    internal_link = node.parent and node.parent.name == 'a' and _RE_EVERNOTE_INTERNAL.match(
                         node.parent.get("href", "")
                     )
                     if (   style == 'color:rgb(105, 170, 53);' # Green/yellowish color of internal links
                         or style == "color:rgb(24, 168, 65);--inversion-type-color:simple;" # Green color
                         and internal_link
-                        and self.options.get("remove_green_link", True)):
+                        and self._remove_green_link):
                             pass # don't add color
                     elif self._use_html("text color / color:rgb"):
                         return f'<span style="{style}">{content}</span>'
@@ -277,9 +333,11 @@ class EvernoteHTMLToMarkdownConverter:
 
         # If we are formatting an external link, format only the anchor text
         url = None
-        if node.next and node.next.name == "a" and not content.startswith("[["):
-            if (parts := re.findall(r'^\[(.*?)\]\((.*?)\)(.*)$', content, flags=re.S) ):
-                content, url, lf = parts[0]
+        # (checking the content first, since most content is not a link)
+        if (content.startswith("[") and not content.startswith("[[")
+            and node.next_element and node.next_element.name == "a"):
+            if (parts := _RE_MD_LINK.search(content)):
+                content, url, lf = parts.groups()
 
         result  = content
         # Check if there are spaces inside the tag, e.g., "<b>bold </b>",
@@ -331,28 +389,28 @@ class EvernoteHTMLToMarkdownConverter:
         if node.name == "ol":
             self.number_indent[self.indent_level] = 0
 
-        result = ''
+        result = []
         # If there is a <ul> or <ol> inside a <li>, add a new line at the start
         if node.parent and node.parent.name == "li":
-            result = "\n"
-        for child in node.children:
-            result += self._process_node(child)
+            result.append("\n")
+        result.extend(self._process_node(child) for child in node.contents)
 
         self.indent_level -= 1
         self.list_stack.pop()
-        return result
+        return ''.join(result)
 
     def _process_list_item(self, node) -> str:
         """Process list items with proper indentation."""
         indent  = '    ' * (self.indent_level - 1)
-        content = self._process_node_children(node)
+        style   = node.get('style', '')
+        content = self._process_node_children(node, style)
         content = content.strip()
 
         # If list item has \n in the content, add indent
         content = content.replace("\n", f"\n{indent}   ")
 
-        if '--en-checked:' in node.get('style', ''):
-            checked = '--en-checked:true' in node.get('style', '')
+        if '--en-checked:' in style:
+            checked = '--en-checked:true' in style
             marker = '[x]' if checked else '[ ]'
             return f'{indent}- {marker} {content}\n'
         elif self.list_stack and self.list_stack[-1] == 'ol':
@@ -366,7 +424,7 @@ class EvernoteHTMLToMarkdownConverter:
         """Convert HTML table to Markdown table."""
         # We can't converted nested tables. In that case, just return the HTML.
         if node.find("table"):
-            self.warnings.append("Nested tables are not supported, returning HTML")
+            self._warn("Nested tables are not supported, returning HTML")
             return str(node)
 
         # Convert HTML table to Markdown table.
@@ -379,9 +437,9 @@ class EvernoteHTMLToMarkdownConverter:
         RIGHT      = "--:"
 
         # Step 1: Count rows and maximum number of columns
-        rows = node.find_all('tr')
-        for row in rows:
-            cols = row.find_all(["th", "td"])
+        # (keeping the cells of each row, so we don't need to search for them again)
+        rows = [row.find_all(["th", "td"]) for row in node.find_all('tr')]
+        for cols in rows:
             current_cols = sum(int(cell.get("colspan", 1)) for cell in cols)
             max_cols = max(max_cols, current_cols)
 
@@ -391,7 +449,7 @@ class EvernoteHTMLToMarkdownConverter:
 
         def add_to_grid(col_num, row_num, cell_content, html_node):
             cell  = grid[row_num][col_num]
-            child = next(html_node.children, None)
+            child = html_node.contents[0] if html_node.contents else None
             if child and hasattr(child, "get"):
                 style = child.get("style", "")
                 if   "text-align:center" in style: cell["align"] = CENTER
@@ -400,8 +458,7 @@ class EvernoteHTMLToMarkdownConverter:
 
         # Step 3: Fill the grid
         row_num = 0
-        for row in rows:
-            cols = row.find_all(["th", "td"])
+        for cols in rows:
             if cols:
                 col_num = 0  # Column number of the current cell
                 for cell in cols:
@@ -433,7 +490,7 @@ class EvernoteHTMLToMarkdownConverter:
         # Step 5: Add separators / column alignments
         if result:
             # Use the most common ("mode") alignment of each column as separator
-            separators = [mode([grid[r][c]["align"] for r in range(len(grid))]) for c in range(max_cols)]
+            separators = [Counter(cell["align"] for cell in column).most_common(1)[0][0] for column in zip(*grid)]
             result.insert(1, f"| {' | '.join(separators)} |")
 
         self.inside_table = False
@@ -459,22 +516,22 @@ class EvernoteHTMLToMarkdownConverter:
         escape  = "\\" if self.inside_table else ""
 
         style = None
-        if (match := re.search(r'<span style="(.*?)">(.*?)</span>', content)):
+        if (match := _RE_SPAN_STYLE.search(content)):
             style   = match.group(1)
             content = match.group(2)
 
         # Replace square brackets with parentheses if configuration says so.
-        if self.options.get("escape_brackets", False):
+        if self._escape_brackets:
             # At this point, brackets were already escaped, so remove slashes, too
             content = content.replace(r"\[", "(").replace(r"\]", ")")
 
         # Check for internal links and web note links
-        if    (guid := re.match("evernote:///view/[^/]+/[^/]+/([0-9a-f-]+)/", href)) \
-           or (guid := re.match("https://www.evernote.com/[^/]+/[^/]+/[^/]+/[^/]+/([0-9a-f-]+)", href)) \
-           or (guid := re.match("https://share.evernote.com/note/(.+)", href)):
+        if    (guid := _RE_GUID_EVERNOTE_URI.match(href)) \
+           or (guid := _RE_GUID_EVERNOTE_WEB.match(href)) \
+           or (guid := _RE_GUID_SHARE.match(href)):
             if not (path := self.guid_to_path.get(guid[1])):
                 path = content
-                self.warnings.append(f"Path to link GUID not found: {guid[1]} ({content})")
+                self._warn(f"Path to link GUID not found: {guid[1]} ({content})")
             # Escaping links can get ugly pretty quickly...
             # At this point, square brackets were already escaped,
             # but they don't need to be for internal links, so we remove them...
@@ -499,7 +556,7 @@ class EvernoteHTMLToMarkdownConverter:
         title = node.get('title', '') 
         if src.startswith("data:image"):
             # Base64 images are exported with <img> tag
-            self.warnings.append(f"Added base64 image")
+            self._warn(f"Added base64 image")
             alt_   = f' alt="{alt}"'     if alt   else ""
             title_ = f' title="{title}"' if title else ""
             return f'<img src="{src}"{alt_}{title_} />'
@@ -507,16 +564,20 @@ class EvernoteHTMLToMarkdownConverter:
             src = f'./_resources{src}'
         return f'![{title or alt}]({src})'
 
-    def _process_media(self, node) -> str:
+    def _process_media(self, node, _block=block_level_elements) -> str:
         """Convert Evernote media to Obsidian Markdown."""
         result = ""
-        type_  = node.get("type",  "")
-        style  = node.get("style", "")
-        hash_hex = node.get("hash")
-        hash_int = int(hash_hex, 16)
-        if not (file_path := self.hash_to_path.get(hash_int)):
+        get    = node.get
+        type_  = get("type",  "")
+        style  = get("style", "")
+        hash_hex = get("hash")
+        try:
+            hash_key = bytes.fromhex(hash_hex)
+        except ValueError: # Malformed hash: handled as a missing attachment
+            hash_key = None
+        if not (file_path := self.hash_to_path.get(hash_key)):
             file_path = hash_hex
-            self.warnings.append(f"Path to media hash not found: {hash_hex}")
+            self._warn(f"Path to media hash not found: {hash_hex}")
             # TO-DO: this happened on a few (4?) notes where the media hash
             # in <resource> and <en-media> where different (Evernote bug?).
             # It could be interesting to list <resource>
@@ -525,7 +586,7 @@ class EvernoteHTMLToMarkdownConverter:
         escape    = "\\" if self.inside_table else ""
         preview   = "" if "--en-viewAs:attachment" in style else "!"
         result    = f"[[{file_path}{escape}|{file_name}]]"
-        if type_.startswith("audio/") or type_.startswith("video/"):
+        if type_.startswith(("audio/", "video/")):
             result = f"!{result}\n"
         elif type_ == "application/pdf":
             # Evernote can show PDF files in 3 different ways: attachment, pdf-pageByPage, pdf-full
@@ -539,13 +600,13 @@ class EvernoteHTMLToMarkdownConverter:
             # in which the PDF is inserted (e.g., in a table cell).
             # In my notes, it was much better to consider the PDF in these cases
             # as an attachment, so we disable the preview.
-            if not style and "autopx" in node.get("height", ""):
+            if not style and "autopx" in get("height", ""):
                 preview = ""
-            pdf_view    = self.options.get("pdf_view", "default")
+            pdf_view    = self._pdf_view
             pdf_preview = {"default": preview, "title": "", "preview": "!"}.get(pdf_view, preview)
             result  = f"{pdf_preview}{result}\n"
         elif type_.startswith("image/"):
-            width = node.get("width","")
+            width = get("width","")
             # Image alignment and full width are not supported in Markdown,
             # but we can use HTML:
             if ("--en-imageAlignment:center" in style and
@@ -566,7 +627,7 @@ class EvernoteHTMLToMarkdownConverter:
                     result = f'<img src="{file_path}" style="width: 100%;">\n'
             else:
                 # If next node is a <div>, <p> or <br>, add a new line, otherwise add a space
-                nl = "\n" if node.next_sibling and node.next_sibling.name in block_level_elements else " "
+                nl = "\n" if node.next_sibling and node.next_sibling.name in _block else " "
                 if width:
                     try:
                         width_val = int(float(width.strip("px")))
@@ -578,58 +639,54 @@ class EvernoteHTMLToMarkdownConverter:
                     result = f'{preview}{result}{nl}'
         else:
             pass
-            #self.warnings.append(f"Unsupported media type: {type_}")
+            #self._warn(f"Unsupported media type: {type_}")
         return result
 
-    def _process_node_children(self, node) -> str:
-        """Process all children of a node."""
-        style = node.get('style', '')
+    def _process_node_children(self, node, style=None) -> str:
+        """Process all children of a node (style: node style, if already known)."""
+        if style is None:
+            style = node.get('style', '')
         entered_codeblock = "--en-codeblock:true"  in style
         if entered_codeblock:
             self.inside_pre = True
-        result = ''.join(self._process_node(child) for child in node.children)
+        result = ''.join([self._process_node(child) for child in node.contents])
         if entered_codeblock:
             self.inside_pre = False
         return result
 
+    @staticmethod
+    def _escape_match(match) -> str:
+        """Return the escaped text for a match of _RE_ESCAPE."""
+        return _escape_sequence(match.group(), match.lastgroup)
+
     def escape_non_url(self, part):
         if self.url_pattern.match(part):
             return part  # Don't escape URLs
 
-        # Escape all instances of [ ] ` * $
-        part = re.sub(r"([\[\]`*\$])", r"\\\1", part)
-
-        # Escape all _ preceeded by nothing or a space and followed by a non-space character
-        part = re.sub(r"(^|\s)([_]+)(?=\S)", lambda m: m.group(1) + "\\" + "\\".join(m.group(2)), part)
+        # Most text has nothing to escape. Finding that out with a simple
+        # character class is much faster than trying all the expressions below.
+        if not _RE_ESCAPE_TRIGGER.search(part):
+            return part
+
+        # Escape, in a single pass:
+        # - all instances of [ ] ` * $
+        # - all _ preceeded by nothing or a space and followed by a non-space character
+        # - "%%"
+        # - possible HTML tags that appear as text
+        # - single # preceded by nothing or spaces, and followed by a non-space character
+        # - single ^ preceded by nothing or spaces, and followed by a non-space character
+        # - sequences of two or more = ~ followed by a non-space character
+        # - - + = > # | when they appear at the start of a line (even if preceeded by spaces)
+        # - ordered / numbered lists (e.g.: 1. ... => 1\. ...)
+        part = _RE_ESCAPE.sub(self._escape_match, part)
 
         # Escape instances of * _ when they are followed by a non-space character
         # Works in editing mode, but not always in reading mode (e.g., "1 * 2 * 3")
         # text = re.sub(r"([*_^]+)(\S)", lambda m: "\\" + "\\".join(m.group(1)) + m.group(2), text)
 
-        # Escape "%%"
-        part = part.replace("%%", "%\\%")
-
-        # Escape possible HTML tags that appear as text
-        part = re.sub(r"<(?=[^>]+>)", r"\\<", part)
-
-        # Escape single # preceded by nothing or spaces, and followed by a non-space character
-        part = re.sub(r'(^|\s)(#)(?=\S)(?!#)', r'\1\\\2', part)
-
-        # Escape single ^ preceded by nothing or spaces, and followed by a non-space character
-        part = re.sub(r'(^|\s)(\^)(?=\S)', r'\1\\\2', part)
-
-        # Escape sequences of two or more = ~ followed by a non-space character
-        part = re.sub(r"([=~]{2,})(?=\S)", lambda m: "\\" + "\\".join(m.group(1)), part)
-
         # Escape sequences of three or more - *
         #text = re.sub("([-*]{3,})", lambda m: "\\" + "\\".join(m.group(1)), text)
 
-        # Escape - + = > # | when they appear at the start of a line (even if preceeded by spaces)
-        part = re.sub(r"(?m)^(\s*)([\-+=>#|])", r"\1\\\2", part)
-
-        # Escape ordered / numbered lists (e.g.: 1. ... => 1\. ...)
-        part = re.sub(r"(?m)^(\s*\d+)(\.\s+)", r"\1\\\2", part)
-
         # If not escaping $ above / previously, these two regexes
         # give a better result when using only editing view.
         # # Escape single dollar signs pair to avoid inline math
@@ -645,17 +702,54 @@ class EvernoteHTMLToMarkdownConverter:
     def _escape_text(self, node) -> str:
         """Escape text content of a node, excluding URLs."""
         text = node.string or ''
-        if not text:
-            return ''
 
         # Do not escape text from <pre>, <code> or <a> tags
-        if self.inside_pre: # or (node.parent and node.parent.name == "a"):
+        if not text or self.inside_pre: # or (node.parent and node.parent.name == "a"):
             return text
 
-        # Split the text into parts, separating URLs and other text
-        parts = re.split(f'({self.url_pattern.pattern})', text)
+        # Nothing in the text would be escaped, with or without URLs in it:
+        # skip the URL search and the Python-level loop below.
+        if not _RE_ESCAPE_TRIGGER.search(text):
+            return text
 
-        # Escape non-URL parts and reconstruct the text
-        escaped_text = ''.join(self.escape_non_url(part) for part in parts)
+        key = (text, self.inside_table)
+        if (cached := self.escape_cache.get(key)) is not None:
+            return cached
 
+        # Escape the text between URLs, keeping the URLs as they are
+        escaped_text = []
+        last = 0
+        for match in self.url_pattern.finditer(text):
+            escaped_text.append(self.escape_non_url(text[last:match.start()]))
+            escaped_text.append(match.group())
+            last = match.end()
+        escaped_text.append(self.escape_non_url(text[last:]))
+
+        escaped_text = self.escape_cache[key] = ''.join(escaped_text)
         return escaped_text
+
+
+# Converter used by convert_one() in worker processes, set by init_worker()
+_worker_converter = None
+_worker_kwargs    = {}
+
+def init_worker(use_html=True, guid_to_path: Dict = None, options: Dict = None):
+    """
+    Initialize a worker process for convert_one(), e.g., as the initializer of a ProcessPoolExecutor.
+    Data shared by all notes is passed here once, instead of once per note.
+    """
+    global _worker_converter, _worker_kwargs
+    _worker_converter = EvernoteHTMLToMarkdownConverter(use_html=use_html)
+    _worker_kwargs    = {"guid_to_path": {} if guid_to_path is None else guid_to_path,
+                         "options":      {} if options      is None else options}
+
+
+def convert_one(args: Tuple) -> Tuple[str, List]:
+    """
+    Convert a single note in a worker process initialized with init_worker().
+    Args   : args : (html_content, tasks, hash_to_path), see convert_html_to_markdown()
+    Returns: (markdown, warnings), as convert_html_to_markdown()
+    """
+    html_content, tasks, hash_to_path = args
+    return _worker_converter.convert_html_to_markdown(
+        html_content, tasks=tasks, hash_to_path=hash_to_path, **_worker_kwargs)
@@ -24,27 +24,61 @@ import pickle
 import logging
 import sqlite3  
 import mimetypes
-from   bs4         import BeautifulSoup
-from   typing      import Sequence, TypeVar
+import multiprocessing
+from   functools   import lru_cache
+from   typing      import Sequence, TypeVar, TYPE_CHECKING
+from   collections import Counter
 from   datetime    import datetime, timezone
 from   zoneinfo    import ZoneInfo
 from   posixpath   import join as posix_join, normpath as posix_normpath, abspath as posix_abspath
-from   evernote2md import EvernoteHTMLToMarkdownConverter
-try:
-    from prompt_toolkit.shortcuts import radiolist_dialog, input_dialog, button_dialog
-    from prompt_toolkit.shortcuts.dialogs import  _return_none, _create_app
+from   evernote2md import EvernoteHTMLToMarkdownConverter, init_worker, convert_one
+from   concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from   types       import SimpleNamespace
+if TYPE_CHECKING:
     from prompt_toolkit.application import Application
-    from prompt_toolkit.application.current import get_app
     from prompt_toolkit.formatted_text import AnyFormattedText
     from prompt_toolkit.styles import BaseStyle
-    from prompt_toolkit.layout.containers import HSplit
-    from prompt_toolkit.widgets import Button, CheckboxList, Dialog, Label
-except ImportError as e:
-    missing_module = str(e).split()[-1].strip("'")
-    print(e)
-    print(f"Error importing module {missing_module} - if not installed, install it with:")
-    print(f"pip install {missing_module}")
-    exit()
+
+# prompt_toolkit is imported on first use by _ptk(), since only menus and dialogs need it
+# (e.g., worker processes importing this module don't)
+_PTK = None
+
+def _ptk():
+    """Return a namespace with the prompt_toolkit functions and classes used in this module."""
+    global _PTK
+    if _PTK is None:
+        try:
+            from prompt_toolkit.shortcuts import radiolist_dialog, input_dialog, button_dialog
+            from prompt_toolkit.shortcuts.dialogs import  _return_none, _create_app
+            from prompt_toolkit.application.current import get_app
+            from prompt_toolkit.layout.containers import HSplit
+            from prompt_toolkit.widgets import Button, CheckboxList, Dialog, Label
+        except ImportError as e:
+            missing_module = str(e).split()[-1].strip("'")
+            print(e)
+            print(f"Error importing module {missing_module} - if not installed, install it with:")
+            print(f"pip install {missing_module}")
+            exit()
+        _PTK = SimpleNamespace(
+            radiolist_dialog = radiolist_dialog,
+            input_dialog     = input_dialog,
+            button_dialog    = button_dialog,
+            return_none      = _return_none,
+            create_app       = _create_app,
+            get_app          = get_app,
+            HSplit           = HSplit,
+            Button           = Button,
+            CheckboxList     = CheckboxList,
+            Dialog           = Dialog,
+            Label            = Label,
+        )
+    return _PTK
+
+# Use orjson if installed (faster), otherwise the standard json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class Config(dict):
@@ -67,19 +101,25 @@ class Config(dict):
     def load(self):
         """Load configuration from a JSON file into the dictionary."""
         try:
-            with open(self.file_name, "r", encoding="utf-8") as f:
-                self.update(json.load(f))
+            with open(self.file_name, "rb") as f:
+                data = f.read()
+            self.update(orjson.loads(data) if orjson else json.loads(data))
         except FileNotFoundError:
             pass
             #print(f"Configuration file '{self.config_file_name}' not found. Using default values.")
-        except json.JSONDecodeError:
+        except ValueError: # json.JSONDecodeError, orjson.JSONDecodeError
             print(f"Error decoding JSON from the file '{self.file_name}'. Using default values.")
 
     def save(self):
         """Save the dictionary to a JSON file."""
+        # Serialize in memory, then write the file at once
+        if orjson:
+            data = orjson.dumps(dict(self), option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+        else:
+            data = json.dumps(self, indent=2, sort_keys=True).encode("utf-8")
         try:
-            with open(self.file_name, "w", encoding="utf-8") as f:
-                json.dump(self, f, indent=2, sort_keys=True)
+            with open(self.file_name, "wb") as f:
+                f.write(data)
         except IOError as e:
             print(f"Error writing to the file '{self.file_name}': {e}")
 
@@ -128,6 +168,14 @@ for option, value, name, help in (
 
 cfg     = Config(default=default_cfg) # Global var. used by most functions
 
+# Notebooks with fewer notes than this are converted to Markdown in the main process
+PARALLEL_MIN_NOTES = 64
+# Max. size of notes (and attachments) read in the 1st pass of an export, kept in memory for the 2nd pass
+EXPORT_CACHE_MB    = 512
+# Threads writing attachments during an export, and max. size of attachments waiting to be written
+WRITE_THREADS      = 4
+WRITE_QUEUE_MB     = 256
+
 # Logging
 IMPORTANT = logging.CRITICAL +10
 logging.addLevelName(IMPORTANT, "IMPORTANT")
@@ -187,47 +235,47 @@ def cfg_menu():
     """Show current configuration and allow user to change it."""
 
     global cfg
-    values = [(o, f"{option_data[o]['menu_name']}: {cfg[o] if o in cfg else default_cfg[o]}") for o in option_data]
-    option = radiolist_dialog(
-        title  = "Configuration",
-        text   = "Select an item then <Change> to modify it, or <Back> to return:",
-        ok_text     = "Change",
-        cancel_text = "Back",
-        values      = values,
-    ).run()
-    if option is None:
-        return True
-
-    name  = option_data[option]["name"]
-    otype = option_data[option]["type"]
-    help  = option_data[option]["help"]
-    title = f"Change '{name}'"
-    text  = f"{help}\n\nEnter new value for '{name}':"
-    new_value = None
-    if otype in [str, int, float]:
-        new_value = input_dialog(
-            title = title,
-            text  = text,
-            default = str(cfg[option] or "")).run()
-    elif otype is bool or otype is list:
-        if otype is list:
-              _values = [ (v, v) for v in option_data[option]["options"]]
-        else: _values = [ (True, "True"), (False, "False")]
-        new_value = radiolist_dialog(
-            title = title, 
-            text  = text, 
-            values  = _values,
-            default = cfg[option] ).run()
-
-    if new_value is not None:
-        if   otype is int:   cfg[option] = int  (new_value)
-        elif otype is float: cfg[option] = float(new_value)
-        else:                cfg[option] = new_value
-        cfg.save()
-        if option == "log_file":
-            restart_log()
-
-    return cfg_menu()
+    while True:
+        values = [(o, f"{option_data[o]['menu_name']}: {cfg[o] if o in cfg else default_cfg[o]}") for o in option_data]
+        option = _ptk().radiolist_dialog(
+            title  = "Configuration",
+            text   = "Select an item then <Change> to modify it, or <Back> to return:",
+            ok_text     = "Change",
+            cancel_text = "Back",
+            values      = values,
+        ).run()
+        if option is None:
+            return True
+
+        data  = option_data[option]
+        name  = data["name"]
+        otype = data["type"]
+        help  = data["help"]
+        title = f"Change '{name}'"
+        text  = f"{help}\n\nEnter new value for '{name}':"
+        new_value = None
+        if otype in [str, int, float]:
+            new_value = _ptk().input_dialog(
+                title = title,
+                text  = text,
+                default = str(cfg[option] or "")).run()
+        elif otype is bool or otype is list:
+            if otype is list:
+                  _values = [ (v, v) for v in data["options"]]
+            else: _values = [ (True, "True"), (False, "False")]
+            new_value = _ptk().radiolist_dialog(
+                title = title, 
+                text  = text, 
+                values  = _values,
+                default = cfg[option] ).run()
+
+        if new_value is not None:
+            if   otype is int:   cfg[option] = int  (new_value)
+            elif otype is float: cfg[option] = float(new_value)
+            else:                cfg[option] = new_value
+            cfg.save()
+            if option == "log_file":
+                restart_log()
 
 
 def open_db(db_path):
@@ -248,129 +296,222 @@ in the configuration, or sync Evernote data with:
         log(logging.CRITICAL, "Exception:", e)
         return
 
+    # Read note BLOBs through memory mapping, with a larger page cache (64 MB)
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    # Notes are read per notebook, sorted by title: let SQLite use an index instead of sorting.
+    # Not an error if the index can't be created (e.g., database is read-only or locked).
+    try:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_nb_title ON notes(notebook_guid, title COLLATE NOCASE)")
+    except sqlite3.OperationalError as e:
+        log(logging.DEBUG, f"Could not create index in database {db_path}: {e}")
+
+    # From here on, the database is only read
+    # (journal_mode / synchronous are left alone: they don't matter for reads,
+    # and journal_mode would be changed in the evernote-backup database itself)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
     return conn
 
 
+# Regular expression pattern for emojis, excluding Japanese Unicode ranges
+# Might be incomplete and/or plain wrong...
+_RE_EMOJI = re.compile(
+    r"["
+    r"\U0001F600-\U0001F64F"  # emoticons
+    r"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    r"\U0001F680-\U0001F6FF"  # transport & map symbols
+    r"\U0001F700-\U0001F77F"  # alchemical symbols
+    r"\U0001F780-\U0001F7FF"  # Geometric shapes extended
+    r"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    r"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    r"\U0001FA00-\U0001FA6F"  # Chess Symbols
+    r"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    r"\U00002702-\U000027B0"  # Dingbats
+   #"\U000024C2-\U0001F251"  # Enclosed characters # Conflicts with Japanese / Kanji
+    r"\U0001F1E6-\U0001F1FF"  # Flags (iOS)
+    r"\U00002500-\U00002BEF"  # Geometric Shapes
+    r"]", flags=re.UNICODE)
+
+@lru_cache(maxsize=4096)
 def has_emoji(s):
-    # Regular expression pattern for emojis, excluding Japanese Unicode ranges
-    # Might be incomplete and/or plain wrong...
-    emoji_pattern = re.compile(
-        r"[\U0001F600-\U0001F64F]"  # emoticons
-        r"|[\U0001F300-\U0001F5FF]"  # symbols & pictographs
-        r"|[\U0001F680-\U0001F6FF]"  # transport & map symbols
-        r"|[\U0001F700-\U0001F77F]"  # alchemical symbols
-        r"|[\U0001F780-\U0001F7FF]"  # Geometric shapes extended
-        r"|[\U0001F800-\U0001F8FF]"  # Supplemental Arrows-C
-        r"|[\U0001F900-\U0001F9FF]"  # Supplemental Symbols and Pictographs
-        r"|[\U0001FA00-\U0001FA6F]"  # Chess Symbols
-        r"|[\U0001FA70-\U0001FAFF]"  # Symbols and Pictographs Extended-A
-        r"|[\U00002702-\U000027B0]"  # Dingbats
-       #"|[\U000024C2-\U0001F251]"  # Enclosed characters # Conflicts with Japanese / Kanji
-        r"|[\U0001F1E6-\U0001F1FF]"  # Flags (iOS)
-        r"|[\U00002500-\U00002BEF]"  # Geometric Shapes
-        , flags=re.UNICODE)
-
-    return bool(emoji_pattern.search(s))
-
-
-invalid_chars = r'[\\*"/<>:|?]'
+    return _RE_EMOJI.search(s) is not None
+
+
+invalid_chars     = r'[\\*"/<>:|?]'
+_RE_INVALID_CHARS = re.compile(invalid_chars)
 
 def is_invalid_obsidian_title(title):
     """ Return False if title is valid, otherwise return invalid chars. """
-    invalid_matches = re.findall(invalid_chars, title)
-    if cfg.get("check_emojis") and has_emoji(title):
+    return _invalid_title_chars(title, bool(cfg.get("check_emojis")))
+
+@lru_cache(maxsize=4096)
+def _invalid_title_chars(title, check_emojis):
+    # Cached for is_invalid_obsidian_title(): the same names (notebooks, stacks,
+    # attachments) are checked many times. The config. option is part of the key.
+    invalid_matches = _RE_INVALID_CHARS.findall(title)
+    # No emojis in ASCII, and most titles are ASCII only
+    if check_emojis and not title.isascii() and has_emoji(title):
         invalid_matches.append("emoji")
     if not invalid_matches:
         return False
     return f"{' '.join(invalid_matches)}"
 
 
-def repeated_strings(str_list, msg):
-    # Dictionary to store the occurrence count of each string
-    string_counts = {}
-
-    # Count occurrences of each string (case-insensitive and stripped of whitespace)
-    for s in str_list:
-        if s:
-            normalized_str = s.lower().strip()
-            string_counts[normalized_str] = string_counts.get(normalized_str, 0) + 1
-
-    # Filter strings that have more than one occurrence and sort them by count (descending)
-    duplicates = {
-        string: count for string, count in sorted(
-            string_counts.items(), key=lambda item: item[1], reverse=True
-        ) if count > 1
-    }
+def normalize_string(s):
+    # Case-insensitive and stripped of whitespace, for finding repeated strings
+    return s.lower().strip() if s else None
 
-    # Report duplicates if any
+
+def report_repeated(duplicates, msg):
+    """Log (string, count) pairs from duplicates if any. Return the number of duplicated strings."""
     if duplicates:
         log(IMPORTANT, msg)
-        for string, count in duplicates.items():
+        for string, count in duplicates:
             log(IMPORTANT, f"  {count:3}: {string}")
-
-    # Return the number of duplicated strings found
     return len(duplicates)
 
 
+def repeated_strings(str_list, msg):
+    # Count occurrences of each string, then keep strings that have more than one occurrence,
+    # sorted by count (descending)
+    string_counts = Counter(normalize_string(s) for s in str_list if s)
+    duplicates    = [(string, count) for string, count in string_counts.most_common() if count > 1]
+    return report_repeated(duplicates, msg)
+
+
+def repeated_note_titles(conn, notebook_guids, msg):
+    # Same as repeated_strings(), but counting directly in the DB.
+    # Titles are normalized with the same Python function, since SQLite's lower() is ASCII only.
+    conn.create_function("normalize_string", 1, normalize_string, deterministic=True)
+    placeholders = ",".join("?" * len(notebook_guids))
+    active_only  = "" if cfg["export_trash"] else "and is_active=1"
+    duplicates = conn.execute(
+            "select normalize_string(title) as t, COUNT(*) as c from notes "
+            f"where notebook_guid in ({placeholders}) {active_only} and t is not null "
+            "group by t having c > 1 order by c desc, t",
+            list(notebook_guids) ).fetchall()
+    return report_repeated(duplicates, msg)
+
+
+def notebook_sort_key(notebook):
+    # Sort by stack, then by notebook name (the separator keeps stack names apart from notebook names)
+    return f"{notebook['stack'] or ''}\x00{notebook['name']}".lower()
+
+
+def selected_notebooks():
+    """Return the set of GUIDs of selected notebooks (empty if all notebooks are selected)."""
+    return frozenset(cfg["notebooks"] or ())
+
+
 def get_notebooks_from_db(conn):
     return [dict(zip(["guid", "name", "stack"], row))
             for row in conn.execute("select guid, name, stack from notebooks")]
 
 
-def get_notes_from_notebook(conn, notebook_guid):
+def count_active_notes(conn):
+    """Return {notebook_guid: number of active notes} for all notebooks."""
+    return dict(conn.execute(
+            "select notebook_guid, SUM(is_active=1) from notes group by notebook_guid"))
+
+
+def get_note_from_db(conn, note_guid):
     return conn.execute(
+            "select is_active, raw_note from notes where guid=?",
+            (note_guid, )
+    ).fetchone()
+
+
+def get_notes_from_notebook(conn, notebook_guid, active_only=False):
+    # With active_only, deleted notes are skipped by SQLite, without reading their (large) raw_note
+    cur = conn.execute(
             "select is_active, raw_note from notes where notebook_guid=? "
+            f"{'and is_active=1 ' if active_only else ''}"
             "order by title COLLATE NOCASE",
             (notebook_guid, )
     )
+    cur.arraysize = 256 # rows per fetchmany()
+    return cur
+
+
+def decode_note(raw_note):
+    # Insert Rick and Morty reference... 🥒
+    return pickle.loads(lzma.decompress(raw_note))
+
+
+def decoder_pool():
+    """Return a pool of worker processes for decode_notes(), or None if there is a single CPU."""
+    return ProcessPoolExecutor() if (os.cpu_count() or 1) > 1 else None
+
+
+def decode_notes(conn, notebook_guid, pool=None):
+    """
+    Yield the notes in a notebook, skipping deleted notes according to config.
+    Notes are decompressed and unpickled in `pool`, if given (see decoder_pool()).
+    """
+    cur = get_notes_from_notebook(conn, notebook_guid, active_only=not cfg["export_trash"])
+    decoded = () # Notes of the previous batch (of cur.arraysize rows)
+    while (rows := cur.fetchmany()):
+        raw_notes = [raw_note for is_active, raw_note in rows]
+        if pool:
+            # Submit this batch before yielding the previous one, so the workers
+            # are not idle while the caller processes notes and the next rows are read
+            batch = pool.map(decode_note, raw_notes, chunksize=32)
+            yield from decoded
+            decoded = batch
+        else:
+            yield from map(decode_note, raw_notes)
+    yield from decoded
 
 _T = TypeVar("_T")
 
 
 def custom_checkboxlist_dialog(
-    title: AnyFormattedText = "",
-    text: AnyFormattedText = "",
+    title: "AnyFormattedText" = "",
+    text: "AnyFormattedText" = "",
     ok_text: str = "Ok",
     cancel_text: str = "Cancel",
-    values: Sequence[tuple[_T, AnyFormattedText]] | None = None,
-    default_values: Sequence[_T] | None = None,
-    style: BaseStyle | None = None,
-) -> Application[list[_T]]:
+    values: "Sequence[tuple[_T, AnyFormattedText]] | None" = None,
+    default_values: "Sequence[_T] | None" = None,
+    style: "BaseStyle | None" = None,
+) -> "Application[list[_T]]":
     """
     Display a simple list of element the user can choose multiple values amongst.
 
     Several elements can be selected at a time using Arrow keys and Enter.
     The focus can be moved between the list and the buttons with tab.
     """
+    ptk = _ptk()
     if values is None:
         values = []
 
     def ok_handler() -> None:
-        get_app().exit(result=cb_list.current_values)
+        ptk.get_app().exit(result=cb_list.current_values)
 
-    cb_list = CheckboxList(values=values, default_values=default_values)
+    cb_list = ptk.CheckboxList(values=values, default_values=default_values)
 
     def set_all_cb_list(cb_list, all_marked):
         if all_marked:
               cb_list.current_values = [key for key, value in values]
         else: cb_list.current_values = []
 
-    dialog = Dialog(
+    dialog = ptk.Dialog(
         title=title,
-        body=HSplit(
-            [Label(text=text, dont_extend_height=True), cb_list],
+        body=ptk.HSplit(
+            [ptk.Label(text=text, dont_extend_height=True), cb_list],
             padding=1,
         ),
         buttons=[
-            Button(text="All",  handler=lambda: set_all_cb_list(cb_list, True )),
-            Button(text="None", handler=lambda: set_all_cb_list(cb_list, False)),
-            Button(text=ok_text, handler=ok_handler),
-            Button(text=cancel_text, handler=_return_none),
+            ptk.Button(text="All",  handler=lambda: set_all_cb_list(cb_list, True )),
+            ptk.Button(text="None", handler=lambda: set_all_cb_list(cb_list, False)),
+            ptk.Button(text=ok_text, handler=ok_handler),
+            ptk.Button(text=cancel_text, handler=ptk.return_none),
         ],
         with_background=True,
     )
 
-    return _create_app(dialog, style)
+    return ptk.create_app(dialog, style)
 
 
 def sel_nb_menu():
@@ -381,21 +522,15 @@ def sel_nb_menu():
 
     notebooks = get_notebooks_from_db(conn)
 
-    cur = conn.execute("select COUNT(*) from notes where is_active=1")
-    num_active = int(cur.fetchone()[0])
-
-    cur = conn.execute("select COUNT(*) from notes where is_active=0")
-    num_deleted = int(cur.fetchone()[0])
+    notes_by_status = dict(conn.execute("select is_active, COUNT(*) from notes group by is_active"))
+    num_active      = notes_by_status.get(1, 0)
+    num_deleted     = notes_by_status.get(0, 0)
+    num_notes_by_nb = count_active_notes(conn)
 
     guids_notebooks = {}
 
-    for notebook in sorted(
-            notebooks, 
-            key = lambda x: f"{x['stack' or '']}{x['name']}".lower() ):
-        cur = conn.execute(
-                "select COUNT(*) from notes where notebook_guid=? and is_active=1",
-                (notebook["guid"],) )
-        num_notes = int(cur.fetchone()[0])
+    for notebook in sorted(notebooks, key=notebook_sort_key):
+        num_notes = num_notes_by_nb.get(notebook["guid"], 0)
         stack     = notebook["stack"] or ""
         if stack: stack = f"{stack} / "
         guids_notebooks[notebook["guid"]] = f"{stack}{notebook['name']} ({num_notes:,})"
@@ -419,9 +554,16 @@ def sel_nb_menu():
     return True
 
 
+@lru_cache(maxsize=4096)
 def safe_path(path):
     # TO-DO: add in config. a custom character, translation map or regex?
-    return re.sub(invalid_chars, "_", path.strip())
+    return _RE_INVALID_CHARS.sub("_", path.strip())
+
+
+@lru_cache(maxsize=128)
+def guess_extension(mime):
+    # Few distinct MIME types for thousands of attachments
+    return mimetypes.guess_extension(mime) # "image/png" -> ".png"
 
 
 def safe_join(*paths):
@@ -441,47 +583,108 @@ def list_db():
         return False
 
     notebooks = get_notebooks_from_db(conn)
+    selected  = selected_notebooks()
+    num_notes_by_nb = count_active_notes(conn)
 
     log(IMPORTANT, "Listing notes in selected notebooks.")
 
-    for notebook in sorted(notebooks, key=lambda x: f"{x['stack' or '']}{x['name']}".lower() ):
+    pool = decoder_pool()
+
+    for notebook in sorted(notebooks, key=notebook_sort_key):
         # Process only selected notebooks
-        if cfg["notebooks"] and notebook["guid"] not in cfg["notebooks"]:
+        if selected and notebook["guid"] not in selected:
             continue
 
         stack_name    = (notebook["stack"] or "").strip()
         notebook_name = notebook["name"].strip()
 
         # Get number of notes in notebook
-        cur = conn.execute(
-                "select COUNT(*) from notes where notebook_guid=? and is_active=1",
-                (notebook["guid"],) )
-        num_notes = int(cur.fetchone()[0])
+        num_notes = num_notes_by_nb.get(notebook["guid"], 0)
         prefix    = stack_name or ""
         if prefix: prefix = f"{prefix} / "
         log(IMPORTANT, f"{prefix}{notebook_name} ({num_notes:,} notes)")
 
-        cur = conn.execute(
-                "select is_active, raw_note from notes where notebook_guid=? "
-                "order by title COLLATE NOCASE",
-                (notebook["guid"], ) )
-
-        for row_note in cur:
-            is_active, raw_note = row_note
-
-            # Skip processing deleted notes according to config.
-            if not (is_active or cfg["export_trash"]):
-                continue
-
-            # Insert Rick and Morty reference...
-            note = pickle.loads(lzma.decompress(raw_note))
+        for note in decode_notes(conn, notebook["guid"], pool):
             log(IMPORTANT, f" - {note.title}")
 
+    if pool:
+        pool.shutdown()
     conn.close()
     input("\n[ENTER] to continue.")
     return True
 
 
+def get_en_note_content(enml):
+    """Return the content inside <en-note ...> and </en-note>, or "" if not found."""
+    # Same as re.search("<en-note[^>]*?>(.+?)</en-note>", enml, re.DOTALL), without a regex
+    if (start := enml.find("<en-note")) < 0 or (start := enml.find(">", start) + 1) == 0:
+        return ""
+    if (end := enml.find("</en-note>", start + 1)) < 0:
+        return ""
+    return enml[start:end]
+
+
+_EMPTY_LINE = "<div><br/></div>"
+
+def is_empty_note_content(content):
+    """Return True if content is empty or only has empty lines."""
+    # Same as `not content.replace(_EMPTY_LINE, "")`, without copying content for most notes
+    return not content or (
+            len(content) % len(_EMPTY_LINE) == 0
+        and content.startswith(_EMPTY_LINE)
+        and not content.replace(_EMPTY_LINE, ""))
+
+# One pass over the note for all checks based on regexes (see scan_db for details):
+# - tables with "colspan" or "rowspan" > 1
+# - "HTML Content" styles
+_RE_SCAN_ISSUES = re.compile(
+    r'(?P<merged_cell>(?:col|row)span="(?!1")\d+")'
+    r'|(?P<html_content>style="[^"]*(?:flex:|box-shadow:|float:\s*(?:left|right)|position:\s*(?:absolute|fixed|sticky)))')
+# Formatting which is not an issue, removed before checking for unsupported formatting
+# TO-DO: add this somehow in the configuration ?
+_RE_SCAN_IGNORE = re.compile("|".join((
+    r'color\s*:\s*rgb\s*\(\s*24\s*,\s*168\s*,\s*65\s*', # green color for internal links
+    r"color\s*:\s*rgb\s*\(\s*105\s*,\s*170\s*,\s*53",   # green color for internal links
+    r"color\s*:\s*#69aa35",                             # green color for internal links
+    r"color\s*:\s*rgb\(\s*71,\s*18\s*,\s*100",          # white / blueish color?
+    r"border-color\s*:\s*#ccc",                         # border color of table cells
+)))
+
+
+# Formatting not supported in Markdown: {issue name: text(s) in the note that show it is used}
+_UNSUPPORTED_FORMATTING = {
+    "table of contents" : ("--en-tableofcontents:true",),
+    "underline"         : ("<u>",),
+    "superscript"       : ("<sup>",),
+    "subscript"         : ("<sub>",),
+    "highlight (red)"   : ("--en-highlight:red",),
+    "highlight (green)" : ("--en-highlight:green",),
+    "highlight (blue)"  : ("--en-highlight:blue",),
+    "highlight (purple)": ("--en-highlight:purple",),
+    "highlight (orange)": ("--en-highlight:orange",),
+    "font type"         : ("--en-fontfamily:",),
+    "font size"         : ("font-size:",),
+    "font color"        : ('"color:', 'font color='),
+   #"HTML content": Any "uneditable" HTML in Evernote, such as
+   # nested tables, appears in an "HTML content" box.
+}
+# All texts in a single pass: {text: issue name}
+_UNSUPPORTED_BY_TEXT = {text: issue_name for issue_name, texts in _UNSUPPORTED_FORMATTING.items() for text in texts}
+_RE_UNSUPPORTED      = re.compile("|".join(re.escape(text) for text in _UNSUPPORTED_BY_TEXT))
+
+_RE_TABLE_TAG = re.compile(r"<(/?)table\b", re.IGNORECASE)
+
+def has_nested_tables(content):
+    """Return True if there is a <table> inside another <table> in content."""
+    depth = 0
+    for match in _RE_TABLE_TAG.finditer(content):
+        if match[1]:
+            depth = max(depth - 1, 0)
+        elif (depth := depth + 1) > 1:
+            return True
+    return False
+
+
 def scan_db():
     """Scan the DB and list possible issues before conversion."""
 
@@ -489,10 +692,14 @@ def scan_db():
         return False
 
     notebooks = get_notebooks_from_db(conn)
+    selected  = selected_notebooks()
+    num_notes_by_nb = count_active_notes(conn)
 
     log(IMPORTANT, "Looking for issues in selected notebooks.")
 
-    note_titles  = []
+    pool = decoder_pool()
+
+    scanned_notebooks = []
     attachments  = []
     full_paths   = []
     attachments_size = 0
@@ -500,6 +707,7 @@ def scan_db():
     notes_with_issues = 0
     max_path_len  = cfg["max_path_len"]
     max_attach_MB = cfg["max_attach_MB"] * 1024 * 1024
+    output_folder = to_posix(cfg["output_folder_md"])
 
     def issue(msg):
         nonlocal total_issues
@@ -507,22 +715,19 @@ def scan_db():
         total_issues += 1
         return 1
 
-    for notebook in sorted(notebooks, key=lambda x: f"{x['stack' or '']}{x['name']}".lower() ):
+    for notebook in sorted(notebooks, key=notebook_sort_key):
         # Process only selected notebooks
-        if cfg["notebooks"] and notebook["guid"] not in cfg["notebooks"]:
+        if selected and notebook["guid"] not in selected:
             continue
+        scanned_notebooks.append(notebook["guid"])
 
         # Folder names can't end with a space, so remove them
         stack_name    = (notebook["stack"] or "").strip()
         notebook_name = notebook["name"].strip()
-        output_folder = to_posix(cfg["output_folder_md"])
         notebook_path = posix_join(output_folder, safe_join(stack_name, notebook_name))
 
         # Get number of notes in notebook
-        cur = conn.execute(
-                "select COUNT(*) from notes where notebook_guid=? and is_active=1",
-                (notebook["guid"],) )
-        num_notes = int(cur.fetchone()[0])
+        num_notes = num_notes_by_nb.get(notebook["guid"], 0)
         prefix    = stack_name or ""
         if prefix: prefix = f"{prefix} / "
         log(IMPORTANT, f"{prefix}{notebook_name} ({num_notes:,} notes)")
@@ -542,25 +747,9 @@ def scan_db():
             issue(f"Folder name from notebook starting with a dot will be hidden: {notebook_name}")
 
         # Check each note in the notebook for issues
-        cur = conn.execute(
-                "select is_active, raw_note from notes where notebook_guid=? "
-                "order by title COLLATE NOCASE",
-                (notebook["guid"], ) )
-
-        for row_note in cur:
-            is_active, raw_note = row_note
-
-            # Skip processing deleted notes according to config.
-            if not (is_active or cfg["export_trash"]):
-                continue
-
-            # Insert Rick and Morty reference...
-            note = pickle.loads(lzma.decompress(raw_note))
-
+        for note in decode_notes(conn, notebook["guid"], pool):
             note_has_issue = 0
-            re_note_content = re.search("<en-note[^>]*?>(.+?)</en-note>", note.content, re.DOTALL)
-            note_content = re_note_content[1] if re_note_content else ""
-            note_titles.append(note.title)
+            note_content = get_en_note_content(note.content)
 
             # Check for invalid names in note titles
             if (chars := is_invalid_obsidian_title(note.title)):
@@ -571,62 +760,35 @@ def scan_db():
 
             # Check if note content is empty
             if not cfg["export_empty_note"]:
-                if not note_content.replace("<div><br/></div>", ""):
+                if is_empty_note_content(note_content):
                     note_has_issue = issue(f"[{note.title}] Empty note")
 
+            found = set()
+            for match in _RE_SCAN_ISSUES.finditer(note_content):
+                found.add(match.lastgroup)
+                if len(found) == 2:
+                    break
+
             # Check if there are tables with "colspan" or "rowspan" > 1
-            if cfg["check_tables"]:
-                num_span = re.findall(r'(?:col|row)span="(\d+)"', note_content)
-                if any(n != "1" for n in num_span):
-                    note_has_issue = issue(f"[{note.title}] Merged cell in a table")
+            if cfg["check_tables"] and "merged_cell" in found:
+                note_has_issue = issue(f"[{note.title}] Merged cell in a table")
 
             # Check if there is "HTML Content" in the note. That is any HTML
             # content not editable in Evernote (but there is no list of that
             # content, AFAIK, so this is probably only a very small sample).
             # Can produce some false positives.
-            if re.findall(r'style="[^"]*(flex:|box-shadow:|float:\s*(?:left|right)|position:\s*(?:absolute|fixed|sticky))', note_content):
+            if "html_content" in found:
                 note_has_issue = issue(f'[{note.title}] "HTML Content" block in note')
 
             # Another unsupported HTML content is nested tables
-            soup = BeautifulSoup(note_content, "html.parser")
-            tables = soup.find_all("table")
-            if any([table.find("table") for table in tables]):
+            if has_nested_tables(note_content):
                 note_has_issue = issue(f"[{note.title}] Nested tables in note")
 
             # Check for formatting not supported in Markdown
             if cfg["check_format"]:
-                unsupported = {
-                    "table of contents" : "--en-tableofcontents:true",
-                    "underline"         : "<u>",
-                    "superscript"       : "<sup>",
-                    "subscript"         : "<sub>",
-                    "highlight (red)"   : "--en-highlight:red",
-                    "highlight (green)" : "--en-highlight:green",
-                    "highlight (blue)"  : "--en-highlight:blue",
-                    "highlight (purple)": "--en-highlight:purple",
-                    "highlight (orange)": "--en-highlight:orange",
-                    "font type"         : "--en-fontfamily:",
-                    "font size"         : "font-size:",
-                    "font color"        : ('"color:', 'font color='),
-                   #"HTML content": Any "uneditable" HTML in Evernote, such as
-                   # nested tables, appears in an "HTML content" box.
-                }
-                # TO-DO: add this somehow in the configuration ?
-                ignore_regex = set((
-                    r'color\s*:\s*rgb\s*\(\s*24\s*,\s*168\s*,\s*65\s*', # green color for internal links
-                    r"color\s*:\s*rgb\s*\(\s*105\s*,\s*170\s*,\s*53",   # green color for internal links
-                    r"color\s*:\s*#69aa35",                             # green color for internal links
-                    r"color\s*:\s*rgb\(\s*71,\s*18\s*,\s*100",          # white / blueish color?
-                    r"border-color\s*:\s*#ccc",                         # border color of table cells
-                ))
-                filtered_note_content = note_content
-                for regex in ignore_regex:
-                    filtered_note_content = re.sub(regex, "", filtered_note_content)
-                issues = []
-                for issue_name, issue_tests in unsupported.items():
-                    for test in issue_tests if isinstance(issue_tests, tuple) else (issue_tests,):
-                        if test in filtered_note_content:
-                            issues.append(issue_name)
+                filtered_note_content = _RE_SCAN_IGNORE.sub("", note_content)
+                formatting = {_UNSUPPORTED_BY_TEXT[match[0]] for match in _RE_UNSUPPORTED.finditer(filtered_note_content)}
+                issues     = [issue_name for issue_name in _UNSUPPORTED_FORMATTING if issue_name in formatting]
                 if issues:
                     note_has_issue = issue(f"[{note.title}] Unsupported formatting: {', '.join(issues)}")
 
@@ -663,7 +825,7 @@ def scan_db():
             notes_with_issues += note_has_issue
 
     # Check for repeated note titles
-    total_issues += repeated_strings(note_titles, "Repeated note titles:")
+    total_issues += repeated_note_titles(conn, scanned_notebooks, "Repeated note titles:")
 
     # Check for repeated attachment file names
     total_issues += repeated_strings(attachments, "Repeated attachment file names:")
@@ -671,13 +833,15 @@ def scan_db():
     if total_issues:
         log(IMPORTANT, f"{total_issues:,} issues found in {notes_with_issues} notes.")
 
+    if pool:
+        pool.shutdown()
     conn.close()
     input("\n[ENTER] to continue.")
     return True
 
 
 def confirm_conversion_dialog(title="Confirm conversion?"):
-    return button_dialog(
+    return _ptk().button_dialog(
         title = title,
         text  = """Did you check for issues already? If so, proceed; otherwise, better cancel and check.
 Did you select the notebooks you want to convert? (No selection = export all!)
@@ -695,7 +859,27 @@ Be sure to enable logging and check it after conversion.""",
     ).run()
 
 
-def get_unique_filename(filename, existing_files):
+def write_bytes(path, data, chunk_size=1024*1024):
+    """Write data to a binary file. Large data is written in chunks, without copying it."""
+    with open(path, "wb", buffering=256*1024) as fh:
+        if len(data) <= 4 * chunk_size:
+            fh.write(data)
+        else:
+            view = memoryview(data)
+            for i in range(0, len(view), chunk_size):
+                fh.write(view[i:i + chunk_size])
+
+
+def get_unique_filename(filename, existing_files, counters=None):
+    """
+    Return filename, or filename with "(1)", "(2)", ... before the extension, not in existing_files (lowercase).
+    Pass the same `counters` dict in every call to start from the last counter used for a filename,
+    instead of trying again all the names taken (e.g. for many notes named "Untitled").
+    """
+    key = filename.lower()
+    if key not in existing_files:
+        return filename
+
     if '.' in filename:
         name, extension = filename.rsplit('.', 1)
         extension = '.' + extension  # Keep the '.' in the extension
@@ -703,15 +887,19 @@ def get_unique_filename(filename, existing_files):
         name = filename
         extension = ''
 
-    unique_filename = filename
-    counter = 1
-    while unique_filename.lower() in existing_files:
-        unique_filename = f"{name}({counter}){extension}"
+    counter = counters.get(key, 1) if counters is not None else 1
+    while (unique_filename := f"{name}({counter}){extension}").lower() in existing_files:
         counter += 1
+    if counters is not None:
+        counters[key] = counter + 1
 
     return unique_filename
 
 
+# Tags in note properties can't have spaces
+_TAG_TABLE = str.maketrans(" ", "-")
+
+
 class Exporter:
     def __init__(self, 
                  format,
@@ -725,10 +913,24 @@ class Exporter:
         self.note_ext      = note_ext
 
 
-    def convert(self, content, guid_to_path, path_to_guid, hash_to_path, tasks, options):
+    def convert(self, note_guid, content, guid_to_path, path_to_guid, hash_to_paths, note_hash_to_path, tasks, options):
         raise NotImplementedError("Subclasses must implement this method")
 
 
+    def convert_notes(self, notes, guid_to_path, path_to_guid, hash_to_paths, options):
+        """
+        Convert a batch of notes, given as (note_guid, content, tasks, note_hash_to_path) tuples.
+        Returns an iterable of (converted_content, conversion_issues), in the same order as `notes`.
+        """
+        for note_guid, content, tasks, note_hash_to_path in notes:
+            yield self.convert(note_guid, content, guid_to_path, path_to_guid, hash_to_paths, note_hash_to_path, tasks, options)
+
+
+    def close(self):
+        """Release any resources used by convert_notes()."""
+        pass
+
+
     def export(self):
         option = confirm_conversion_dialog(self.confirm_title)
         if option is None:     return False
@@ -737,26 +939,27 @@ class Exporter:
         if not (conn := open_db(cfg['database'])):
             return False
 
+        # Read all tasks & reminders at once, instead of querying the DB for each note / task
+        tasks_by_note     = {} # K: note GUID, V: [(task GUID, raw task), ...]
+        reminders_by_task = {} # K: task GUID, V: [raw reminder, ...]
+        try:
+            for note_guid, task_guid, raw_task in conn.execute("select note_guid, guid, raw_task from tasks"):
+                tasks_by_note.setdefault(note_guid, []).append((task_guid, raw_task))
+            for task_guid, raw_reminder in conn.execute("select task_guid, raw_reminder from reminders"):
+                reminders_by_task.setdefault(task_guid, []).append(raw_reminder)
+        except sqlite3.OperationalError as e:
+            log(logging.DEBUG, "Tasks table not found in the database. Skipping task processing.")
+        except Exception as e:
+            log(logging.WARN, f"Error executing query for tasks: {e}")
+
         def get_tasks_for_note_id(note_guid):
             tasks = {}
             # Get tasks for this note
-            try:
-                cursor = conn.execute(
-                    "select guid, raw_task from tasks where note_guid=?",
-                    (note_guid, ) )
-            except sqlite3.OperationalError as e:
-                log(logging.DEBUG, f"Tasks table not found in the database. Skipping task processing for note {note_guid}.")
-                return tasks
-            except Exception as e:
-                log(logging.WARN, f"Error executing query for tasks for note {note_guid}: {e}")
-                return tasks
-            for task_guid, raw_task in cursor:
+            for task_guid, raw_task in tasks_by_note.get(note_guid, ()):
                 try:
                     task = json.loads(lzma.decompress(raw_task).decode("utf-8"))
                     # Get reminders for this task
-                    for reminder_guid, raw_reminder in conn.execute(
-                        "select guid, raw_reminder from reminders where task_guid=?",
-                        (task_guid,) ):
+                    for raw_reminder in reminders_by_task.get(task_guid, ()):
                         try:
                             reminder = json.loads(lzma.decompress(raw_reminder).decode("utf-8"))
                             task["reminders"].append(reminder)
@@ -767,21 +970,18 @@ class Exporter:
                     log(logging.CRITICAL, f"Error reading task {task_guid} (for note {note_guid}): {e}")
             return tasks
 
-        def get_note_notecontent(row_note):
-            note, note_content, tasks = False, False, []
-            is_active, raw_note = row_note
-            # Skip processing deleted notes according to config.
-            if is_active or cfg["export_trash"]:
-                # Insert Rick and Morty reference... 🥒
-                note = pickle.loads(lzma.decompress(raw_note))
-                re_note_content = re.search("<en-note[^>]*?>(.+?)</en-note>", note.content, re.DOTALL)
-                note_content = re_note_content[1] if re_note_content else ""
-                # Check if note content is empty
-                if not cfg["export_empty_note"]:
-                    if not note_content.replace("<div><br/></div>", ""):
-                        return False, False, tasks
-                # Check if there are tasks & reminders in the db for this note
-                tasks = get_tasks_for_note_id(note.guid)
+        def get_note_notecontent(note):
+            # Deleted notes were already skipped according to config. (see decode_notes)
+            note_content = get_en_note_content(note.content)
+            # The full ENML is not used after this, so don't keep it in memory
+            # (e.g., twice when the note is kept for the 2nd pass)
+            note.content = None
+            # Check if note content is empty
+            if not cfg["export_empty_note"]:
+                if is_empty_note_content(note_content):
+                    return False, False, []
+            # Check if there are tasks & reminders in the db for this note
+            tasks = get_tasks_for_note_id(note.guid)
 
             return note, note_content, tasks
 
@@ -797,16 +997,23 @@ class Exporter:
         guid_to_path_rel = {} # Keep track of Evernote internal links to notes and files (relative path, used in links in the notes)
         guid_to_path_abs = {} # Keep track of Evernote internal links to notes and files (absolute path, used internally during conversion)
         path_to_guid     = {} # Keep track of Evernote internal links to notes and files
-        hash_to_paths    = {} # Keep track of Evernote hashes to attachments
+        hash_to_paths    = {} # Keep track of Evernote hashes to attachments      (K: hash, V: {note GUID: path})
+        note_hash_paths  = {} # Same as hash_to_paths, indexed by note GUID first (K: note GUID, V: {hash: path})
         filenames_set    = set() # Keep track of filenames in lowercase
+        filename_counters = {} # Last counter used to make each filename unique, see get_unique_filename()
         notebook_data    = []
+        decoded_notes    = {} # K: note GUID, V: (note, note_content, tasks) from the 1st pass, to avoid decoding them again
+        cache_size       = 0  # Approx. size of notes in decoded_notes
+        cache_max_size   = EXPORT_CACHE_MB * 1024 * 1024
         notebooks        = get_notebooks_from_db(conn)
-        sorted_notebooks = sorted(notebooks, key=lambda x: f"{x['stack' or '']}{x['name']}".lower() )
+        selected         = selected_notebooks()
+        sorted_notebooks = sorted(notebooks, key=notebook_sort_key)
+        pool             = decoder_pool()
 
         for notebook in sorted_notebooks:
             # If we process only selected notebooks, processing time can be 
             # shortened, but links to notes in other notebooks won't be found.
-            if cfg["notebooks"] and notebook["guid"] not in cfg["notebooks"]:
+            if selected and notebook["guid"] not in selected:
                 continue
 
             # Folder names can't end with a space or dot, so remove them
@@ -816,25 +1023,38 @@ class Exporter:
             notebook_name     = safe_path(re.sub(r"[\s\.]+$", "", notebook_name))
             notebook_path_rel = posix_join(stack_name, notebook_name)
             notebook_path_abs = posix_join(self.output_folder, notebook_path_rel)
+            # Joined once per notebook, so paths for notes and attachments are simple concatenations
+            rel_prefix        = posix_join(notebook_path_rel, "")
+            abs_prefix        = posix_join(notebook_path_abs, "")
+            resource_prefix   = posix_join(rel_prefix, "_resources", "")
+            notebook_notes = [] # GUIDs of notes to export, in the order they are exported
             notebook_data.append({
                 "guid"    : notebook["guid"],
                 "path_rel": notebook_path_rel,
                 "path_abs": notebook_path_abs,
+                "notes"   : notebook_notes,
             })
 
-            # Get notes in the current notebook
-            for row_note in get_notes_from_notebook(conn, notebook["guid"]):
-                note, note_content, tasks = get_note_notecontent(row_note)
+            # Get notes in the current notebook (decoded in parallel, if possible)
+            for note in decode_notes(conn, notebook["guid"], pool):
+                note, note_content, tasks = get_note_notecontent(note)
                 if not note: # skip deleted or empty notes, according to config.
                     continue
 
+                # Keep the decoded note for the 2nd pass, if it fits in the cache
+                notebook_notes.append(note.guid)
+                size = len(note_content) + sum(resource.data.size or 0 for resource in note.resources or [])
+                if cache_size + size <= cache_max_size:
+                    decoded_notes[note.guid] = (note, note_content, tasks)
+                    cache_size += size
+
                 # Create unique RELATIVE note path from notebook and note title
                 safe_name     = safe_path(f"{note.title}{self.note_ext}")
-                safe_name     = get_unique_filename(safe_name, filenames_set)
+                safe_name     = get_unique_filename(safe_name, filenames_set, filename_counters)
                 if cfg["links_with_folders"]:
-                      note_path_rel = posix_join(notebook_path_rel, safe_name)
+                      note_path_rel = rel_prefix + safe_name
                 else: note_path_rel = safe_name
-                note_path_abs = posix_join(notebook_path_abs, safe_name)
+                note_path_abs = abs_prefix + safe_name
                 filenames_set.add(note_path_rel.lower())
                 path_to_guid    [note_path_rel] = note.guid
                 guid_to_path_rel[note.guid]     = note_path_rel
@@ -850,26 +1070,27 @@ class Exporter:
                     # and there can be issues in Obsidian displaying files with wrong extension.
                     # So, be sure attachment has a file name with correct extension.
                     fn        = resource.attributes.fileName or "unnamed"
-                    mime_ext  = mimetypes.guess_extension(resource.mime) # "image/png" -> ".png"
                     root, ext = os.path.splitext(fn)
                     if root.strip() == "":
                         root = "unnamed"
                     if ext.strip() == "" and resource.mime != "application/octet-stream":
-                        ext = mime_ext
+                        ext = guess_extension(resource.mime)
                     fn = safe_path(f"{root}{ext}")
 
                     # TO-DO:
                     # - Allow user to select folder for attachments (one per notebook / one per note ?)
                     #   - In case of HTML files, use "correct" format ([html file without ext]_files) ?
                     # - We're also not checking if there are links to each/all attachment in the note content. But should we?
-                    attachment_folder_rel = "_resources"
-                    # Create a unique full relative path for the attachment
-                    full_attachment_path_rel = posix_join(notebook_path_rel, attachment_folder_rel, fn)
-                    unique_full_path_rel     = get_unique_filename(full_attachment_path_rel, filenames_set)
-                    attachment_path_rel      = to_posix(os.path.relpath(unique_full_path_rel, notebook_path_rel)) # Path relative to note
-                    attachment_path_abs      = posix_join(self.output_folder, unique_full_path_rel)
-
-                    fn = os.path.split(attachment_path_abs)[-1]
+                    # Create a unique full relative path for the attachment (in the "_resources" folder)
+                    unique_full_path_rel = get_unique_filename(resource_prefix + fn, filenames_set, filename_counters)
+                    if unique_full_path_rel.startswith(resource_prefix):
+                        attachment_path_rel = unique_full_path_rel[len(rel_prefix):] # Path relative to note
+                        attachment_path_abs = abs_prefix + attachment_path_rel
+                    else: # "(n)" was added to a folder name with a dot, if the file name has no extension
+                        attachment_path_rel = to_posix(os.path.relpath(unique_full_path_rel, notebook_path_rel))
+                        attachment_path_abs = posix_join(self.output_folder, unique_full_path_rel)
+
+                    fn = attachment_path_abs.rpartition("/")[2]
                     if resource.attributes.fileName and fn != resource.attributes.fileName:
                         log(logging.WARNING, f'  - Attachment renamed from "{resource.attributes.fileName}" to "{attachment_path_abs}" in {note_path_abs}')
 
@@ -883,34 +1104,53 @@ class Exporter:
                     path_to_guid[attachment_path_rel] = resource.guid
                     guid_to_path_rel[resource.guid]   = attachment_path_rel
                     guid_to_path_abs[resource.guid]   = attachment_path_abs
-                    hash = int.from_bytes(resource.data.bodyHash) # Better int than .hex().zfill(32) ?
+                    hash = bytes(resource.data.bodyHash) # As bytes: faster to hash and compare than int or .hex()
                     # Store all paths for a given hash, keyed by the note's GUID
                     if hash not in hash_to_paths:
                         hash_to_paths[hash] = {}
                     hash_to_paths[hash][note.guid] = attachment_path_rel
+                    note_hash_paths.setdefault(note.guid, {})[hash] = attachment_path_rel
+
+        if pool:
+            pool.shutdown()
 
         # 2nd pass: export notes
         log(IMPORTANT, f"Exporting from {cfg['database']} to {self.format} into {self.output_folder}")
 
+        # Attachments are written by other threads (file I/O releases the GIL), while notes are converted
+        writer         = ThreadPoolExecutor(max_workers=WRITE_THREADS)
+        pending_writes = [] # (future, path) of attachments not yet written
+        pending_size   = 0
+        def wait_writes():
+            nonlocal pending_size
+            for future, path in pending_writes:
+                if (e := future.exception()):
+                    errors.append( log(logging.ERROR, f"  Error saving {path}: **{e}**") )
+            pending_writes.clear()
+            pending_size = 0
+
         for nb_data in notebook_data:
-            notebook_guid     = nb_data["guid"]
             notebook_path_rel = nb_data["path_rel"]
             notebook_path_abs = nb_data["path_abs"]
 
-            # Get number of notes in notebook
-            cur = conn.execute(
-                    "select COUNT(*) from notes where notebook_guid=? and is_active=1",
-                    (notebook_guid,) )
-            num_notes = int(cur.fetchone()[0])
+            # Number of notes to export in notebook (from the 1st pass)
+            num_notes = len(nb_data["notes"])
             log(IMPORTANT, f"{num_notes:5,} notes - {notebook_path_abs}")
 
             os.makedirs(notebook_path_abs, exist_ok=True)
 
-            # Get notes in the current notebook
-            for row_note in get_notes_from_notebook(conn, notebook_guid):
-                note, note_content, tasks = get_note_notecontent(row_note)
-                if not note: # skip deleted or empty notes, according to config.
-                    continue
+            # Notes are converted after all notes in the notebook are read, to allow batch conversion.
+            # Keep only what is needed for that, so the resources of each note can be freed.
+            notes_to_convert = [] # (note_guid, note_content, task_groups, {hash: path})
+            notes_to_save    = [] # (title, note_path_abs, md_properties)
+
+            # Get notes in the current notebook (from the cache, or from the DB again)
+            for note_guid in nb_data["notes"]:
+                if (decoded := decoded_notes.pop(note_guid, None)):
+                    note, note_content, tasks = decoded
+                else:
+                    is_active, raw_note       = get_note_from_db(conn, note_guid)
+                    note, note_content, tasks = get_note_notecontent(decode_note(raw_note))
 
                 note_path_abs = guid_to_path_abs[note.guid]
 
@@ -958,12 +1198,12 @@ class Exporter:
                     if not cfg["overwrite"] and os.path.exists(attachment_path_abs):
                         log(logging.WARNING, f"    - Skipping, already exists: {attachment_path_abs}")
                     else:
-                        try:
-                            with open(attachment_path_abs, "wb") as fh:
-                                fh.write(resource.data.body)
-                            log(logging.INFO, f"    - ({len(resource.data.body):,} bytes) {attachment_path_abs}")
-                        except Exception as e:
-                            errors.append( log(logging.ERROR, f"  Error saving {attachment_path_abs}: **{e}**") )
+                        future = writer.submit(write_bytes, attachment_path_abs, resource.data.body)
+                        pending_writes.append((future, attachment_path_abs))
+                        pending_size += len(resource.data.body)
+                        log(logging.INFO, f"    - ({len(resource.data.body):,} bytes) {attachment_path_abs}")
+                        if pending_size > WRITE_QUEUE_MB * 1024 * 1024:
+                            wait_writes()
 
                 if save_note:
                     # Prepare note properties
@@ -995,31 +1235,38 @@ class Exporter:
                     # if note.attributes.lastEditorId:      md_properties.append(f"lastEditorId: {note.attributes.lastEditorId}")
                     if note.tagNames:
                         md_properties.append("tags:")
-                        for tag in note.tagNames:
-                            tag_name = tag.replace(" ", "-")
-                            md_properties.append(f" - {tag_name}")
+                        md_properties.extend(f" - {tag.translate(_TAG_TABLE)}" for tag in note.tagNames)
                     md_properties.append("---\n")
                     md_properties = "\n".join(md_properties)
 
-                    # Convert note body to HTML or Markdown
-                    converted_content, conversion_issues = self.convert(
-                        note, note_content, guid_to_path_rel, path_to_guid, hash_to_paths, task_groups, cfg)
-
-                    if conversion_issues:
-                        log(logging.WARNING, f'Issues converting "{note.title}" ({note_path_abs}):')
-                        for issue in conversion_issues:
-                            log(logging.WARNING, f"  - {issue}")
-
-                    # Save note
-                    try:
-                        with open(note_path_abs, "w", encoding="utf-8") as fh:
-                            if self.note_ext == ".md":
-                                fh.write(md_properties)
-                            if cfg["first_line_empty"]:
-                                converted_content = "\n" + converted_content
-                            fh.write(converted_content)
-                    except Exception as e:
-                        errors.append( log(logging.ERROR, f"  Error saving {note_path_abs}: **{e}**") )
+                    notes_to_convert.append((note.guid, note_content, task_groups, note_hash_paths.get(note.guid, {})))
+                    notes_to_save.append((note.title, note_path_abs, md_properties))
+
+            # Convert note bodies to HTML or Markdown
+            converted_notes = self.convert_notes(notes_to_convert, guid_to_path_rel, path_to_guid, hash_to_paths, cfg)
+            for (title, note_path_abs, md_properties), (converted_content, conversion_issues) in zip(notes_to_save, converted_notes):
+                if conversion_issues:
+                    log(logging.WARNING, f'Issues converting "{title}" ({note_path_abs}):')
+                    for issue in conversion_issues:
+                        log(logging.WARNING, f"  - {issue}")
+
+                # Save note
+                try:
+                    # A single write. Text mode is kept for the OS line endings.
+                    parts = [md_properties] if self.note_ext == ".md" else []
+                    if cfg["first_line_empty"]:
+                        parts.append("\n")
+                    parts.append(converted_content)
+                    with open(note_path_abs, "w", encoding="utf-8", buffering=256*1024) as fh:
+                        fh.write("".join(parts))
+                except Exception as e:
+                    errors.append( log(logging.ERROR, f"  Error saving {note_path_abs}: **{e}**") )
+
+            # Report errors saving attachments with the notebook they belong to
+            wait_writes()
+
+        writer.shutdown()
+        self.close()
 
         if errors:
             log(logging.ERROR, f"{len(errors):,} error(s) found.")
@@ -1031,6 +1278,21 @@ class Exporter:
         return True
 
 
+# Used by Exporter_HTML.convert()
+_RE_EN_MEDIA     = re.compile(r'<en-media ([^>]+)\s*/>')
+_RE_EN_HREF      = re.compile(r'"(?:evernote:///view/[^/]+/[^/]+/(.+?)/.+?|https://share.evernote.com/note/(.+?))"')
+
+
+def _attr(tag, name):
+    """Value of the first `name="..."` in tag (attributes of an <en-media> tag), or "" if not found."""
+    if (start := tag.find(f'{name}="')) < 0:
+        return ""
+    start += len(name) + 2
+    if (end := tag.find('"', start)) < 0:
+        return ""
+    return tag[start:end]
+
+
 class Exporter_HTML(Exporter):
     def __init__(self):
         super().__init__(
@@ -1041,20 +1303,23 @@ class Exporter_HTML(Exporter):
         )
 
 
-    def convert(self, note, content, guid_to_path, path_to_guid, hash_to_paths, tasks, options):
+    def convert(self, note_guid, content, guid_to_path, path_to_guid, hash_to_paths, note_hash_to_path, tasks, options):
 
         errors = []
 
         def subs_en_media(regex_match) -> str:
             en_media = regex_match[1]
             result = en_media
-            type_  = re.findall('type="([^"]+)"', en_media)[0]
-            hash_hex = re.findall('hash="([^"]+)"', en_media)[0]
-            hash_int = int(hash_hex, 16)
+            type_  = _attr(en_media, "type")
+            hash_hex = _attr(en_media, "hash")
+            try:
+                hash_key = bytes.fromhex(hash_hex)
+            except ValueError: # Malformed hash: handled as a missing attachment
+                hash_key = None
 
             # Find the correct path for this attachment in this specific note
-            note_hash_paths = hash_to_paths.get(hash_int, {})
-            path = note_hash_paths.get(note.guid)
+            note_hash_paths = hash_to_paths.get(hash_key, {})
+            path = note_hash_paths.get(note_guid)
 
             if not path:
                 # Fallback to any available path if the specific one isn't found
@@ -1064,8 +1329,8 @@ class Exporter_HTML(Exporter):
                     path = hash_hex # Use the hex string as a fallback path
 
             if type_.startswith("image"):
-                    width  = (re.findall(' width="[^"]+"',  en_media) or [""])[0]
-                    height = (re.findall(' height="[^"]+"', en_media) or [""])[0]
+                    width  = (f' width="{w}"'  if (w := _attr(en_media, " width"))  else "")
+                    height = (f' height="{h}"' if (h := _attr(en_media, " height")) else "")
                     result = f'<img src="{path}"{width}{height} />'
             elif self.note_ext == ".md":
                 # Obsidian doesn't support most of the HTML tags below,
@@ -1094,8 +1359,10 @@ class Exporter_HTML(Exporter):
                 log(logging.ERROR, f"    - [ERROR] Path to GUID not found: {guid} ({path})")
             return f'"{path}"'
 
-        content = re.sub(r'<en-media ([^>]+)\s*/>', subs_en_media, content)
-        content = re.sub(r'"(?:evernote:///view/[^/]+/[^/]+/(.+?)/.+?|https://share.evernote.com/note/(.+?))"', subs_href, content)
+        content = _RE_EN_MEDIA.sub(subs_en_media, content)
+        # Most notes have no links to other notes: skip the search if the start of both alternatives is missing
+        if '"evernote:///view/' in content or '"https://share' in content:
+            content = _RE_EN_HREF.sub(subs_href, content)
         return content, errors
 
 
@@ -1108,20 +1375,16 @@ class Exporter_MD(Exporter):
             note_ext      = ".md",
         )
         self.converter = EvernoteHTMLToMarkdownConverter(use_html=cfg["html_with_md_ext"])
+        self.pool      = None # Worker processes, created on first use by convert_notes()
 
 
-    def convert(self, note, content, guid_to_path, path_to_guid, hash_to_paths, tasks, options):
-        # Create a simple {hash: path} dictionary for the current note for the converter
-        note_specific_hash_to_path = {
-            hash_val: paths.get(note.guid)
-            for hash_val, paths in hash_to_paths.items() if note.guid in paths
-        }
+    def convert(self, note_guid, content, guid_to_path, path_to_guid, hash_to_paths, note_hash_to_path, tasks, options):
         markdown_content, warnings = self.converter.convert_html_to_markdown(
             content, 
             md_properties = [], # actually processed by parent of this
             tasks = tasks,
             guid_to_path = guid_to_path,
-            hash_to_path = note_specific_hash_to_path,
+            hash_to_path = note_hash_to_path, # simple {hash: path} dictionary for the current note
             options      = options)
 
         # if warnings:
@@ -1131,6 +1394,28 @@ class Exporter_MD(Exporter):
         return markdown_content, warnings
 
 
+    def convert_notes(self, notes, guid_to_path, path_to_guid, hash_to_paths, options):
+        # Conversion is CPU-bound, so use worker processes for larger batches (one per CPU).
+        # guid_to_path and options are the same for all notes, so they are sent to each worker only once.
+        if len(notes) < PARALLEL_MIN_NOTES or (os.cpu_count() or 1) < 2:
+            return super().convert_notes(notes, guid_to_path, path_to_guid, hash_to_paths, options)
+        if self.pool is None:
+            # Workers are started while the attachment writer threads are running:
+            # "spawn" them (as on Windows), since forking a process with threads can deadlock
+            self.pool = ProcessPoolExecutor(
+                mp_context  = multiprocessing.get_context("spawn"),
+                initializer = init_worker,
+                initargs    = (cfg["html_with_md_ext"], guid_to_path, dict(options)))
+        args = [ (content, tasks, note_hash_to_path) for note_guid, content, tasks, note_hash_to_path in notes ]
+        return self.pool.map(convert_one, args, chunksize=16)
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
 def export_html():
     html_exporter = Exporter_HTML()
     return html_exporter.export()
@@ -1144,7 +1429,7 @@ def export_md():
 def read_vault(vault_folder):
     md_data   = {} # K: full path for .md files,            V: note content
     abs_paths = {} # K: full path for non-.md files,        V: { "links": 0 }
-    all_paths = {} # K: full & partial paths for all files, V: count of files with this K path
+    all_paths = {} # K: file name for all files,            V: list of full paths with this file name
     for root, dirs, files in os.walk(vault_folder):
         root = to_posix(root).lower()
         for file in files:
@@ -1158,15 +1443,27 @@ def read_vault(vault_folder):
                     log(logging.CRITICAL, f"scan_vault(): error reading {full_path}: {e}")
             else:
                 abs_paths[full_path] = { "links": 0 }
-            # Split full_path into parts and combine them for all possible partial paths
-            parts = full_path.split("/")
-            for i in range(len(parts)):
-                partial_path = "/".join(parts[i:]) 
-                all_paths[partial_path] = all_paths.get(partial_path, 0) + 1
+            all_paths.setdefault(file, []).append(full_path)
 
     return md_data, abs_paths, all_paths
 
 
+def count_vault_paths(all_paths, link):
+    """Count files (from read_vault()) whose full path is `link`, or ends with "/" + `link`."""
+    suffix = "/" + link
+    return sum(1 for path in all_paths.get(link.rpartition("/")[2], ())
+                 if path == link or path.endswith(suffix))
+
+
+# Code blocks (multiline) and inline code are matched first and ignored,
+# so links inside them are not counted. One pass over each file.
+_RE_VAULT_LINKS = re.compile(r"```.*?```|`[^`]*`"
+                             r"|\[[^\]]+?\]\((?P<external>.+?)\)"
+                             r"|(?<!\\)\[\[(?P<internal>[^\]]+?)\]\]", re.S)
+# Internal links inside the target of an external link, e.g. "[a](b [[c]])"
+_RE_VAULT_INTERNAL = re.compile(r"(?<!\\)\[\[([^\]]+?)\]\]")
+
+
 def scan_vault():
     # Read all vault .md files into memory. Not a bright idea if your vault 
     # is really large, but is only 12 MB in 3k notes in mine, so...
@@ -1190,16 +1487,20 @@ def scan_vault():
 
     for md_path, md_data in md_files.items():
         # Show "empty" notes
-        if re.match(r"^\s*$", md_data):
+        if not md_data.strip():
             log(IMPORTANT, f" - Empty note ({len(md_data)} bytes): {md_path}")
             stats["Empty notes"] += 1
 
         # Count ext. & int. links, internal links not found, linked files
-        clean_md_data  = re.sub(r'```.*?```', '', md_data, flags=re.S)     # Remove code blocks (multiline)
-        clean_md_data  = re.sub(r'`[^`]*`', '', clean_md_data, flags=re.S) # Remove inline code (single line)
-        external_links = re.findall(r"\[[^\]]+?\]\((.+?)\)", clean_md_data, flags=re.S)
-        stats["External links"] += len(external_links)
-        internal_links = re.findall(r"(?<!\\)\[\[([^\]]+?)\]\]", clean_md_data, flags=re.S)
+        internal_links = []
+        for m in _RE_VAULT_LINKS.finditer(md_data):
+            if m.lastgroup == "internal":
+                internal_links.append(m["internal"])
+            elif m.lastgroup == "external":
+                stats["External links"] += 1
+                # The external link consumed its target: look for internal links in it, too
+                if "[[" in (target := m["external"]):
+                    internal_links.extend(_RE_VAULT_INTERNAL.findall(target))
         note_parent_path = os.path.split(md_path)[0]
         for link in internal_links:
             stats["Internal links"] += 1
@@ -1212,7 +1513,7 @@ def scan_vault():
                     # Obsidian can find a relative or partial file name anywhere in the vault.
                     # If there is just one matching path or file name for a link, that's OK.
                     # Otherwise, alert that there might be a conflict.
-                    count = all_paths.get(link, 0)
+                    count = count_vault_paths(all_paths, link)
                     if count > 1:
                         log(IMPORTANT, f" - File name conflict: {link} can refer to {count} files")
                         stats["File name conflicts"] += 1
@@ -1234,7 +1535,7 @@ def scan_vault():
 
 
 def main_menu():
-    option = radiolist_dialog(
+    option = _ptk().radiolist_dialog(
         title  = f"Evernote2Obsidian Markdown converter v.{__version__}",
         text   = "Use mouse/keyboard (TAB/arrows/PgUp/PgDn: navigate; ENTER/SPACE: select):",
         ok_text     = "Run sel.",